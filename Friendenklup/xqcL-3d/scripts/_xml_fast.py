@@ -0,0 +1,99 @@
+"""Optional Numba kernel for serializing 3MF <triangle> lines.
+
+build_xqcL_p1s_ams_3mf.py formats triangles with one bulk %-operation,
+which is fine for the coin parts but becomes the top hot spot for meshes
+with millions of triangles. This module writes the same lines into a
+preallocated uint8 buffer from native code (manual integer -> ASCII), so no
+per-row Python objects are created at all.
+
+numba (and numpy) are optional: format_triangles() returns None when they
+are not installed and the caller falls back to the pure-Python formatter.
+Importing this module imports numba, so the build script only imports it
+for meshes large enough to pay for that. The kernels are module-level
+functions compiled with cache=True, so after the first run the compiled
+code is loaded from __pycache__ instead of being JIT-compiled again.
+"""
+
+try:
+    import numba
+    import numpy as np
+except ImportError:  # numba is optional; format_triangles() returns None.
+    numba = None
+
+# Widest decimal rendering of a vertex index the output buffer is sized for;
+# the kernel does no bounds checking, so larger indices are rejected up front.
+_MAX_INDEX_DIGITS = 10
+
+if numba is not None:
+
+    @numba.njit(cache=True)
+    def _write_uint(out, pos, value):
+        # Digits are produced least-significant first, then reversed in place.
+        start = pos
+        if value == 0:
+            out[pos] = 48  # "0"
+            return pos + 1
+        while value > 0:
+            out[pos] = 48 + value % 10
+            value //= 10
+            pos += 1
+        end = pos - 1
+        while start < end:
+            tmp = out[start]
+            out[start] = out[end]
+            out[end] = tmp
+            start += 1
+            end -= 1
+        return pos
+
+    @numba.njit(cache=True)
+    def _write_bytes(out, pos, frag):
+        for i in range(frag.shape[0]):
+            out[pos + i] = frag[i]
+        return pos + frag.shape[0]
+
+    @numba.njit(cache=True)
+    def _fill_triangles(tri_idx, head, mid1, mid2, tail, out):
+        pos = 0
+        for r in range(tri_idx.shape[0]):
+            pos = _write_bytes(out, pos, head)
+            pos = _write_uint(out, pos, tri_idx[r, 0])
+            pos = _write_bytes(out, pos, mid1)
+            pos = _write_uint(out, pos, tri_idx[r, 1])
+            pos = _write_bytes(out, pos, mid2)
+            pos = _write_uint(out, pos, tri_idx[r, 2])
+            pos = _write_bytes(out, pos, tail)
+        return pos
+
+
+def format_triangles(tri_idx, indent: bytes, tail: bytes):
+    """Return b''.join(indent + b'<triangle v1="a" v2="b" v3="c"' + tail) per row.
+
+    tri_idx is an (N, 3) integer ndarray of non-negative vertex indices;
+    tail is everything after the v3 value's closing quote (attributes,
+    "/>" and the line separator). Returns None if numba is unavailable or
+    an index falls outside 0 <= i < 10**_MAX_INDEX_DIGITS.
+    """
+    if numba is None:
+        return None
+
+    tri = np.ascontiguousarray(tri_idx, dtype=np.int64)
+    if tri.size == 0:
+        return b""
+    if tri.min() < 0 or tri.max() >= 10**_MAX_INDEX_DIGITS:
+        return None
+
+    def frag(b: bytes):
+        return np.frombuffer(b, dtype=np.uint8)
+
+    head = frag(indent + b'<triangle v1="')
+    mid1 = frag(b'" v2="')
+    mid2 = frag(b'" v3="')
+    tail_arr = frag(b'"' + tail)
+
+    row_max = (
+        head.size + mid1.size + mid2.size + tail_arr.size + 3 * _MAX_INDEX_DIGITS
+    )
+    out = np.empty(tri.shape[0] * row_max, dtype=np.uint8)
+    used = _fill_triangles(tri, head, mid1, mid2, tail_arr, out)
+    return out[:used].tobytes()
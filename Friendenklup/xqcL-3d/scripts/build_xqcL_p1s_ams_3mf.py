@@ -26,12 +26,27 @@ Outputs
   "not from bambu lab" warning and sets per-part extruders for AMS)
 """
 
+import argparse
+import io
+import mmap
 import os
 import struct
 import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from xml.sax.saxutils import escape
 
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; the pure-Python paths below still work.
+    np = None
+
+try:
+    from isal import isal_zlib
+except ImportError:  # ISA-L is optional; stdlib zlib is used without it.
+    isal_zlib = None
+
 ROOT = Path(__file__).resolve().parent.parent
 PARTS_DIR = ROOT / "output" / "print_parts"
 
@@ -39,6 +54,8 @@ OUT_ITEMS = ROOT / "output" / "xqcL_coin_P1S_AMS_colored.3mf"
 OUT_ASSEMBLY = ROOT / "output" / "xqcL_coin_P1S_AMS_colored_assembly.3mf"
 # BambuStudio-recognized project 3MF with explicit per-part extruder assignment.
 OUT_BAMBU_PROJECT = ROOT / "output" / "xqcL_coin_P1S_AMS_BambuProject.3mf"
+# Options the 3MFs were last built with; see outputs_up_to_date().
+OUT_OPTIONS_STAMP = ROOT / "output" / ".xqcL_coin_P1S_AMS_3mf.options"
 
 # Filament colors requested (approximate display colors)
 COLORS = {
@@ -48,6 +65,24 @@ COLORS = {
     "wood": "#C8A06A",
 }
 
+# Deflate level for the 3MF zip entries. Level 9 costs roughly 2-3x the CPU
+# of level 6 for ~1% smaller output on the (highly compressible) model XML.
+ZLIB_LEVEL = int(os.environ.get("XQCL_3MF_ZLIB_LEVEL", "6"))
+# With python-isal installed, levels 1 and 3 deflate the model XML with the
+# ISA-L level of the same number, which is smaller than zlib's and faster
+# (level 1: ~2% smaller, ~4x faster; level 3: ~5% smaller, ~1.5x faster).
+# ISA-L level 2 is ~3.5% larger than zlib 2, and nothing in ISA-L comes close
+# to zlib 4-9 (its best level is ~14% larger than zlib 6), so every other
+# level, including 0 (stored), uses zlib and the default output does not
+# depend on isal being installed. XQCL_3MF_ISAL=0 forces stdlib zlib.
+USE_ISAL = isal_zlib is not None and os.environ.get("XQCL_3MF_ISAL", "1") != "0"
+ISAL_LEVELS = (1, 3)
+
+# Decimal places written per vertex coordinate. The STL parts are float32
+# (~7 significant digits), so 6 decimals on a 60 mm coin is mostly noise;
+# 4 (0.1 µm) is far below printer resolution and shrinks the vertex XML.
+COORD_PRECISION = 4
+
 # 3MF namespaces
 NS_CORE = "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"
 NS_M = "http://schemas.microsoft.com/3dmanufacturing/material/2015/02"  # prefix m
@@ -57,57 +92,235 @@ NS_CT = "http://schemas.openxmlformats.org/package/2006/content-types"
 NS_BAMBU = "http://schemas.bambulab.com/package/2021"
 
 
+# Binary STL triangle record: normal, 3 vertices, attribute byte count (50 bytes).
+STL_RECORD = struct.Struct("<12x9f2x")
+STL_DT = (
+    np.dtype([("n", "<f4", 3), ("v", "<f4", (3, 3)), ("attr", "<u2")])
+    if np is not None
+    else None
+)
+
+
 def read_binary_stl(path: Path):
-    b = path.read_bytes()
-    tri_count = struct.unpack_from("<I", b, 80)[0]
-    o = 84
-    tris = []
-    for _ in range(tri_count):
-        o += 12  # normal
-        v = []
-        for __ in range(3):
-            x, y, z = struct.unpack_from("<fff", b, o)
-            o += 12
-            v.append((x, y, z))
-        o += 2
-        tris.append(tuple(v))
-    return tris
+    """Return the triangles of a binary STL.
+
+    With numpy this is a contiguous (N, 3, 3) float32 array; without it, a
+    list of ((x, y, z), (x, y, z), (x, y, z)) tuples.
+
+    The file is memory-mapped rather than read into a bytes object, so the
+    only copy made is of the vertex data that is kept.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        tri_count = struct.unpack_from("<I", mm, 80)[0]
+        end = 84 + tri_count * STL_RECORD.size
+        if len(mm) < end:
+            raise ValueError(
+                f"{path}: truncated binary STL (header says {tri_count} triangles, "
+                f"needs {end} bytes, file has {len(mm)})"
+            )
+        if np is not None:
+            arr = np.frombuffer(mm, dtype=STL_DT, count=tri_count, offset=84)
+            tris = arr["v"].copy()
+            del arr  # release the buffer export before the map is closed
+            return tris
+
+        with memoryview(mm)[84:end] as records:
+            return [
+                (r[0:3], r[3:6], r[6:9]) for r in STL_RECORD.iter_unpack(records)
+            ]
 
 
 def stl_to_indexed_mesh(tris, round_decimals=6):
+    """Weld identical corners into an indexed (vertices, triangles) mesh.
+
+    Corners are welded when they agree after quantizing each coordinate to an
+    integer multiple of 10**-round_decimals. Vertices keep first-seen order so
+    both code paths emit the same XML.
+    """
+    scale = 10**round_decimals
+    if np is not None and isinstance(tris, np.ndarray):
+        pts = tris.reshape(-1, 3)
+        q = np.rint(pts.astype(np.float64) * scale).astype(np.int64)
+        _, first, inv = np.unique(q, axis=0, return_index=True, return_inverse=True)
+        # np.unique numbers vertices in sorted order; renumber by first use.
+        order = np.argsort(first)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.size)
+        vertices = pts[first[order]]
+        triangles = rank[inv.reshape(-1)].reshape(-1, 3).astype(np.int32)
+        return vertices, triangles
+
     vmap = {}
     vertices = []
     triangles = []
+    # Bound once; the loop below is the pure-Python hot path.
+    lookup = vmap.setdefault
+    add_vertex = vertices.append
 
+    # Pack the three quantized coordinates into one Python int: hashing a
+    # single int is much cheaper than a tuple of floats. Each coordinate sits
+    # in its own 48-bit field (exact for |coord| < 2**47 / scale).
     def key(p):
         return (
-            round(p[0], round_decimals),
-            round(p[1], round_decimals),
-            round(p[2], round_decimals),
+            round(p[0] * scale)
+            + (round(p[1] * scale) << 48)
+            + (round(p[2] * scale) << 96)
         )
 
+    # One setdefault per corner: it returns the existing index, or stores
+    # and returns n (the next free index), in which case the corner is new.
+    n = 0
     for (a, b, c) in tris:
-        ka, kb, kc = key(a), key(b), key(c)
-        ia = vmap.get(ka)
-        if ia is None:
-            ia = len(vertices)
-            vmap[ka] = ia
-            vertices.append(a)
-        ib = vmap.get(kb)
-        if ib is None:
-            ib = len(vertices)
-            vmap[kb] = ib
-            vertices.append(b)
-        ic = vmap.get(kc)
-        if ic is None:
-            ic = len(vertices)
-            vmap[kc] = ic
-            vertices.append(c)
+        ia = lookup(key(a), n)
+        if ia == n:
+            add_vertex(a)
+            n += 1
+        ib = lookup(key(b), n)
+        if ib == n:
+            add_vertex(b)
+            n += 1
+        ic = lookup(key(c), n)
+        if ic == n:
+            add_vertex(c)
+            n += 1
         triangles.append((ia, ib, ic))
 
     return vertices, triangles
 
 
+# Bump when stl_to_indexed_mesh output changes, to invalidate sidecar caches.
+MESH_CACHE_VERSION = 2
+
+
+def load_indexed_mesh(stl_path: Path):
+    """Return stl_to_indexed_mesh(read_binary_stl(stl_path)), cached.
+
+    With numpy the indexed mesh is kept in a <name>.idx.npz sidecar next to
+    the STL, keyed by the STL's mtime and size, so unchanged parts skip
+    parsing and welding entirely on rebuilds.
+    """
+    if np is None:
+        return stl_to_indexed_mesh(read_binary_stl(stl_path))
+
+    cached = load_cached_mesh(stl_path)
+    if cached is not None:
+        return cached
+
+    verts, tris = stl_to_indexed_mesh(read_binary_stl(stl_path))
+    try:
+        np.savez(
+            stl_path.with_suffix(".idx.npz"),
+            key=_mesh_cache_key(stl_path),
+            verts=verts,
+            tris=tris,
+        )
+    except OSError:
+        pass  # read-only checkout: just skip caching
+    return verts, tris
+
+
+def _mesh_cache_key(stl_path: Path):
+    st = stl_path.stat()
+    return np.array([MESH_CACHE_VERSION, st.st_mtime_ns, st.st_size], dtype=np.int64)
+
+
+def load_cached_mesh(stl_path: Path):
+    """Return (verts, tris) from a fresh .idx.npz sidecar, or None."""
+    if np is None:
+        return None
+    cache = stl_path.with_suffix(".idx.npz")
+    if not cache.exists():
+        return None
+    try:
+        with np.load(cache) as c:
+            if np.array_equal(c["key"], _mesh_cache_key(stl_path)):
+                return c["verts"], c["tris"]
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        pass  # stale format or partial write; rebuild
+    return None
+
+
+def load_part(part):
+    """Process-pool worker: (name, stl_path, pindex) -> (name, verts, tris, pindex)."""
+    name, stl_path, pindex = part
+    verts, tri_idx = load_indexed_mesh(stl_path)
+    return name, verts, tri_idx, pindex
+
+
+# Rows formatted per chunk when streaming mesh XML into the zip entry.
+MESH_CHUNK_ROWS = 1 << 16
+# Meshes with at least this many triangles are serialized by the Numba kernel
+# in _xml_fast (if numba is installed). Below it, importing/JIT-loading numba
+# costs more than it saves.
+NUMBA_MIN_TRIANGLES = int(os.environ.get("XQCL_3MF_NUMBA_MIN_TRIANGLES", "1000000"))
+
+
+def format_rows(line_fmt: bytes, rows) -> bytes:
+    """Format every row of an (N, k) mesh array with a single %-operation.
+
+    line_fmt holds the k placeholders for one row. Formatting straight into
+    bytes is cheaper than str formatting plus an encode (the model XML is
+    pure ASCII apart from escaped names). Repeating it N times and
+    applying it to the flattened rows keeps the per-row work inside the C
+    formatter instead of a Python-level loop.
+    """
+    if hasattr(rows, "ravel"):
+        flat = rows.ravel().tolist()
+    else:
+        flat = [c for row in rows for c in row]
+    return (line_fmt * len(rows)) % tuple(flat)
+
+
+def format_coords(vertices, coord_fmt: bytes = b"%%.%df" % COORD_PRECISION):
+    """Return vertices with every coordinate pre-formatted as ASCII bytes.
+
+    Welded meshes reuse few distinct coordinate values (the red inlay has
+    ~300 across ~260k coordinates), so each value is converted to decimal
+    once and then looked up, instead of formatting three floats per vertex.
+    """
+    if np is not None and isinstance(vertices, np.ndarray):
+        uniq, inv = np.unique(vertices, return_inverse=True)
+        strs = np.array([coord_fmt % u for u in uniq.tolist()], dtype=object)
+        return strs[inv.reshape(vertices.shape)]
+
+    cache: dict[float, bytes] = {}
+    for row in vertices:
+        for c in row:
+            if c not in cache:
+                cache[c] = coord_fmt % c
+    return [tuple(cache[c] for c in row) for row in vertices]
+
+
+def iter_format_rows(line_fmt: bytes, rows, chunk_rows: int = MESH_CHUNK_ROWS):
+    """Yield format_rows() output in blocks of at most chunk_rows rows."""
+    for start in range(0, len(rows), chunk_rows):
+        yield format_rows(line_fmt, rows[start : start + chunk_rows])
+
+
+def iter_triangle_rows(triangles, tail: bytes, chunk_rows: int = MESH_CHUNK_ROWS):
+    """Yield <triangle> lines in chunks; tail follows the v3 attribute."""
+    indent = b"        "
+    format_fast = None
+    if (
+        np is not None
+        and isinstance(triangles, np.ndarray)
+        and len(triangles) >= NUMBA_MIN_TRIANGLES
+    ):
+        try:
+            import _xml_fast  # sibling module; imports numba when installed
+        except ImportError:
+            pass
+        else:
+            format_fast = _xml_fast.format_triangles
+    line_fmt = indent + b'<triangle v1="%d" v2="%d" v3="%d"' + tail
+    for start in range(0, len(triangles), chunk_rows):
+        rows = triangles[start : start + chunk_rows]
+        chunk = format_fast(rows, indent, tail) if format_fast is not None else None
+        if chunk is None:
+            chunk = format_rows(line_fmt, rows)
+        yield chunk
+
+
 def content_types_xml():
     return f"""<?xml version=\"1.0\" encoding=\"UTF-8\"?>
 <Types xmlns=\"{NS_CT}\">
@@ -125,18 +338,22 @@ def rels_xml():
 """
 
 
-def model_xml(objects, build_mode: str, *, bambu_meta: bool = False, assembly_object_id: int | None = None):
-    """Return 3D/3dmodel.model XML.
+def resolve_assembly_id(objects, assembly_object_id: int | None = None) -> int:
+    """Object id used for the components assembly (defaults to max part id + 1)."""
+    if assembly_object_id is not None:
+        return int(assembly_object_id)
+    return max(obj["id"] for obj in objects) + 1
 
-    build_mode:
-      - "items": separate <build><item objectid=.../></build>
-      - "assembly": build references a components assembly object
 
-    bambu_meta:
-      If True, embed the metadata Bambu Studio uses to decide a 3MF is
-      "from Bambu Lab" (otherwise it may show:
-      "The 3mf file is not from bambu lab, load geometry data only").
+def iter_mesh_xml(objects, coord_precision: int = COORD_PRECISION):
+    """Yield the shared start of <resources> (colorgroup + part meshes) as UTF-8 chunks.
+
+    This is nearly all of the model XML by size and identical for every
+    build layout. Mesh sections are yielded MESH_CHUNK_ROWS lines at a time
+    so it can be streamed. Vertex coordinates get coord_precision decimals.
     """
+    nl = os.linesep
+    coord_fmt = b"%%.%df" % coord_precision
 
     # Color group id=1 with 4 color entries.
     colorgroup = [
@@ -147,60 +364,133 @@ def model_xml(objects, build_mode: str, *, bambu_meta: bool = False, assembly_ob
         f'    <m:color color="{COLORS["wood"]}"/>',
         '  </m:colorgroup>',
     ]
-
-    res_lines = ["<resources>"]
-    res_lines.extend(colorgroup)
+    yield ("<resources>" + nl + nl.join(colorgroup) + nl).encode()
 
     # Part objects. Keep pid/pindex on the object, but do NOT rely on it;
     # Bambu Studio is much more consistent when triangles carry pid+p1/p2/p3.
     for obj in objects:
+        # Everything constant per object is prepared once, outside the
+        # per-vertex/per-triangle formatting.
         pindex = int(obj["pindex"])
-        res_lines.append(
-            f'  <object id="{obj["id"]}" name="{escape(obj["name"])}" type="model" pid="1" pindex="{pindex}">'  # pid=1 -> colorgroup id 1
+        name_escaped = escape(obj["name"])
+        # Triangle-level color assignment (most compatible):
+        # pid -> colorgroup id, p1/p2/p3 -> indices within the colorgroup.
+        tri_tail = f' pid="1" p1="{pindex}" p2="{pindex}" p3="{pindex}"/>{nl}'.encode()
+
+        yield (
+            f'  <object id="{obj["id"]}" name="{name_escaped}" type="model" pid="1" pindex="{pindex}">{nl}'  # pid=1 -> colorgroup id 1
+            f"    <mesh>{nl}"
+            f"      <vertices>{nl}"
+        ).encode()
+        yield from iter_format_rows(
+            f'        <vertex x="%s" y="%s" z="%s"/>{nl}'.encode(), format_coords(obj["vertices"], coord_fmt)
         )
-        res_lines.append("    <mesh>")
-        res_lines.append("      <vertices>")
-        for (x, y, z) in obj["vertices"]:
-            res_lines.append(f'        <vertex x="{x:.6f}" y="{y:.6f}" z="{z:.6f}"/>')
-        res_lines.append("      </vertices>")
-        res_lines.append("      <triangles>")
-        for (v1, v2, v3) in obj["triangles"]:
-            # Triangle-level color assignment (most compatible):
-            # pid -> colorgroup id, p1/p2/p3 -> indices within the colorgroup.
-            res_lines.append(
-                f'        <triangle v1="{v1}" v2="{v2}" v3="{v3}" pid="1" p1="{pindex}" p2="{pindex}" p3="{pindex}"/>'
-            )
-        res_lines.append("      </triangles>")
-        res_lines.append("    </mesh>")
-        res_lines.append("  </object>")
+        yield f"      </vertices>{nl}      <triangles>{nl}".encode()
+        yield from iter_triangle_rows(obj["triangles"], tri_tail)
+        yield f"      </triangles>{nl}    </mesh>{nl}  </object>{nl}".encode()
 
-    effective_assembly_id = None
-    if build_mode == "assembly":
-        effective_assembly_id = (
-            int(assembly_object_id)
-            if assembly_object_id is not None
-            else max(obj["id"] for obj in objects) + 1
-        )
-        res_lines.append(
-            f'  <object id="{effective_assembly_id}" name="xqcL_coin" type="model">'
-        )
-        res_lines.append("    <components>")
-        for obj in objects:
-            res_lines.append(f'      <component objectid="{obj["id"]}"/>')
-        res_lines.append("    </components>")
-        res_lines.append("  </object>")
 
-    res_lines.append("</resources>")
+def _collect(chunks) -> bytes:
+    """Concatenate bytes chunks through a BytesIO.
 
-    build_lines = ["<build>"]
-    if build_mode == "items":
-        for obj in objects:
-            build_lines.append(f'  <item objectid="{obj["id"]}"/>')
-    elif build_mode == "assembly":
-        build_lines.append(f'  <item objectid="{effective_assembly_id}"/>')
-    else:
+    Unlike b"".join(generator), which first materializes the list of all
+    chunks, each chunk can be freed as soon as it is written, which keeps
+    peak memory well below the ~2x of the join.
+    """
+    buf = io.BytesIO()
+    w = buf.write
+    for chunk in chunks:
+        w(chunk)
+    return buf.getvalue()
+
+
+def serialize_meshes(objects, coord_precision: int = COORD_PRECISION) -> bytes:
+    """Return iter_mesh_xml() as one bytes blob, for reuse across outputs."""
+    return _collect(iter_mesh_xml(objects, coord_precision))
+
+
+def new_deflater():
+    """Raw-deflate compressor used for the 3D/3dmodel.model entry."""
+    if USE_ISAL and ZLIB_LEVEL in ISAL_LEVELS:
+        return isal_zlib.compressobj(ZLIB_LEVEL, isal_zlib.DEFLATED, -15)
+    return zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, -15)
+
+
+class SharedBlob:
+    """A model XML chunk written into several 3MFs but deflated only once.
+
+    The deflated form ends with a sync flush, so it is byte-aligned and not
+    marked final; write_3mf splices it between independently compressed
+    prologue/epilogue pieces, which yields one valid deflate stream.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self._deflated: bytes | None = None
+
+    @property
+    def deflated(self) -> bytes:
+        if self._deflated is None:
+            c = new_deflater()
+            self._deflated = c.compress(self.data) + c.flush(zlib.Z_SYNC_FLUSH)
+        return self._deflated
+
+
+class _SplicingCompressor:
+    """zipfile compressor stand-in that can emit SharedBlob.deflated verbatim.
+
+    Data around a blob goes through fresh deflaters so that no back
+    reference ever crosses a splice point.
+    """
+
+    def __init__(self):
+        self._c = new_deflater()
+        self._pending: SharedBlob | None = None
+
+    def splice_next(self, blob: SharedBlob):
+        """Emit blob's deflated bytes for the next compress(blob.data) call."""
+        self._pending = blob
+
+    def compress(self, data) -> bytes:
+        blob, self._pending = self._pending, None
+        if blob is None or data is not blob.data:
+            return self._c.compress(data)
+        out = self._c.flush(zlib.Z_SYNC_FLUSH) + blob.deflated
+        self._c = new_deflater()
+        return out
+
+    def flush(self) -> bytes:
+        return self._c.flush()
+
+
+def wrap_model(
+    meshes,
+    objects,
+    build_mode: str,
+    *,
+    bambu_meta: bool = False,
+    assembly_object_id: int | None = None,
+):
+    """Yield a full 3D/3dmodel.model around already-serialized meshes.
+
+    meshes is a bytes blob, a SharedBlob or an iterable of bytes chunks (see
+    iter_mesh_xml); only the small <model> header, metadata, assembly object
+    and <build> differ per output. Chunks are yielded as UTF-8 bytes (or the
+    SharedBlob itself, for write_3mf to splice).
+
+    build_mode:
+      - "items": separate <build><item objectid=.../></build>
+      - "assembly": build references a components assembly object
+
+    bambu_meta:
+      If True, embed the metadata Bambu Studio uses to decide a 3MF is
+      "from Bambu Lab" (otherwise it may show:
+      "The 3mf file is not from bambu lab, load geometry data only").
+    """
+    if build_mode not in ("items", "assembly"):
         raise ValueError(f"Unknown build_mode: {build_mode}")
-    build_lines.append("</build>")
+
+    nl = os.linesep
 
     meta_lines: list[str] = []
     if bambu_meta:
@@ -219,28 +509,116 @@ def model_xml(objects, build_mode: str, *, bambu_meta: bool = False, assembly_ob
 
     # requiredextensions improves compatibility with slicers that ignore
     # material properties unless explicitly declared.
-    return f"""<?xml version=\"1.0\" encoding=\"UTF-8\"?>
+    yield f"""<?xml version=\"1.0\" encoding=\"UTF-8\"?>
 <model xmlns=\"{NS_CORE}\" xmlns:m=\"{NS_M}\"{bambu_ns} unit=\"millimeter\" requiredextensions=\"m\">
-{os.linesep.join(meta_lines)}
-{os.linesep.join(res_lines)}
-{os.linesep.join(build_lines)}
+{nl.join(meta_lines)}
+""".encode()
+
+    if isinstance(meshes, (bytes, SharedBlob)):
+        yield meshes
+    else:
+        yield from meshes
+
+    res_lines: list[str] = []
+    if build_mode == "assembly":
+        assembly_id = resolve_assembly_id(objects, assembly_object_id)
+        res_lines.append(f'  <object id="{assembly_id}" name="xqcL_coin" type="model">')
+        res_lines.append("    <components>")
+        for obj in objects:
+            res_lines.append(f'      <component objectid="{obj["id"]}"/>')
+        res_lines.append("    </components>")
+        res_lines.append("  </object>")
+    res_lines.append("</resources>")
+
+    build_lines = ["<build>"]
+    if build_mode == "items":
+        for obj in objects:
+            build_lines.append(f'  <item objectid="{obj["id"]}"/>')
+    else:
+        build_lines.append(f'  <item objectid="{resolve_assembly_id(objects, assembly_object_id)}"/>')
+    build_lines.append("</build>")
+
+    yield f"""{nl.join(res_lines)}
+{nl.join(build_lines)}
 </model>
-"""
+""".encode()
+
+
+def iter_model_xml(
+    objects,
+    build_mode: str,
+    *,
+    bambu_meta: bool = False,
+    assembly_object_id: int | None = None,
+    coord_precision: int = COORD_PRECISION,
+):
+    """Yield 3D/3dmodel.model XML as a sequence of UTF-8 bytes chunks.
+
+    See wrap_model for the options. The document is streamed and never held
+    in memory as a whole.
+    """
+    return wrap_model(
+        iter_mesh_xml(objects, coord_precision),
+        objects,
+        build_mode,
+        bambu_meta=bambu_meta,
+        assembly_object_id=assembly_object_id,
+    )
+
+
+def model_xml(objects, build_mode: str, **kwargs) -> str:
+    """Return 3D/3dmodel.model XML as one string (see iter_model_xml)."""
+    return _collect(iter_model_xml(objects, build_mode, **kwargs)).decode("utf-8")
 
 
 def write_3mf(
-    out_path: Path, model_xml_str: str, *, extra_files: dict[str, str] | None = None
+    out_path: Path, model_xml_chunks, *, extra_files: dict[str, str] | None = None
 ):
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    if out_path.exists():
-        out_path.unlink()
+    """Write a 3MF package.
+
+    model_xml_chunks is either the model XML as str/bytes or an iterable of
+    UTF-8 bytes chunks (e.g. iter_model_xml(...)), which is streamed into the
+    zip entry and deflated incrementally. SharedBlob chunks are spliced in
+    already deflated instead of being compressed again.
+    """
+    if isinstance(model_xml_chunks, str):
+        model_xml_chunks = model_xml_chunks.encode("utf-8")
+    if isinstance(model_xml_chunks, bytes):
+        model_xml_chunks = (model_xml_chunks,)
 
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    # Build the package next to the target and move it into place only once the
+    # zip is complete, so an interrupted run never leaves a truncated 3MF with a
+    # fresh mtime behind (outputs_up_to_date() would trust it on the next run).
+    tmp_path = out_path.with_suffix(out_path.suffix + ".tmp")
+    try:
+        _write_3mf_zip(tmp_path, model_xml_chunks, extra_files)
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+
+def _write_3mf_zip(out_path: Path, model_xml_chunks, extra_files):
     with zipfile.ZipFile(
-        out_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=9
+        out_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=ZLIB_LEVEL
     ) as z:
         z.writestr("[Content_Types].xml", content_types_xml())
         z.writestr("_rels/.rels", rels_xml())
-        z.writestr("3D/3dmodel.model", model_xml_str)
+        with z.open("3D/3dmodel.model", "w") as f:
+            # zipfile has no hook for the deflate backend or for pre-deflated
+            # data, so swap the entry's compressor before anything is written
+            # (ISA-L when enabled; SharedBlob splicing either way). zipfile
+            # still computes sizes and the CRC over the uncompressed bytes.
+            splicer = None
+            if getattr(f, "_compressor", None) is not None:
+                splicer = f._compressor = _SplicingCompressor()
+            for chunk in model_xml_chunks:
+                if isinstance(chunk, SharedBlob):
+                    if splicer is not None:
+                        splicer.splice_next(chunk)
+                    chunk = chunk.data
+                f.write(chunk)
         if extra_files:
             for path, content in extra_files.items():
                 z.writestr(path, content)
@@ -275,7 +653,50 @@ def model_settings_config_xml(parent_object_id: int, part_objects: list[dict]) -
     return "\n".join(lines)
 
 
-def main():
+def build_options(args) -> str:
+    """The effective options that change the 3MF bytes, one per line."""
+    isal = USE_ISAL and ZLIB_LEVEL in ISAL_LEVELS
+    return (
+        f"coord_precision={args.coord_precision}\n"
+        f"zlib_level={ZLIB_LEVEL}\n"
+        f"deflate={'isal' if isal else 'zlib'}\n"
+    )
+
+
+def outputs_up_to_date(outputs, inputs, options: str) -> bool:
+    """True if every output exists and is newer than all inputs and this script,
+    and OUT_OPTIONS_STAMP says they were built with the same options."""
+    try:
+        if OUT_OPTIONS_STAMP.read_text() != options:
+            return False
+    except OSError:
+        return False
+    sources = [*inputs, Path(__file__), Path(__file__).with_name("_xml_fast.py")]
+    newest_input = max(p.stat().st_mtime for p in sources)
+    return all(o.exists() and o.stat().st_mtime >= newest_input for o in outputs)
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    ap.add_argument(
+        "--coord-precision",
+        type=int,
+        default=COORD_PRECISION,
+        help=f"decimal places per vertex coordinate (default: {COORD_PRECISION})",
+    )
+    ap.add_argument(
+        "--force",
+        action="store_true",
+        help="rebuild even if the 3MFs are newer than the STL parts and this script",
+    )
+    args = ap.parse_args(argv)
+    if args.coord_precision < 0:
+        ap.error("--coord-precision must be >= 0")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
     parts = [
         ("base_black", PARTS_DIR / "xqcL_coin_base_60mm.stl", 0),
         ("inlay_white", PARTS_DIR / "xqcL_coin_inlay_white.stl", 1),
@@ -290,11 +711,40 @@ def main():
             + ", ".join(missing)
         )
 
+    # make-style short-circuit: nothing to do if every output is newer than
+    # every input (the STL parts and the generator code itself) and was built
+    # with the same --coord-precision / XQCL_3MF_* settings.
+    outputs = (OUT_ITEMS, OUT_ASSEMBLY, OUT_BAMBU_PROJECT)
+    options = build_options(args)
+    if not args.force and outputs_up_to_date(
+        outputs, [p for _, p, _ in parts], options
+    ):
+        print("3MFs are up to date (use --force to rebuild)")
+        return
+    # Drop the stamp until all outputs are rewritten, so an interrupted run
+    # is never mistaken for a complete one.
+    OUT_OPTIONS_STAMP.unlink(missing_ok=True)
+
+    # Parts with a fresh .idx.npz sidecar load in milliseconds, far less than
+    # starting a process pool (~0.9s with spawn, the macOS/Windows default).
+    # Only the parts that need parsing/welding go to worker processes, and
+    # only when there are several of them and more than one CPU.
+    cached = {part: load_cached_mesh(part[1]) for part in parts}
+    misses = [part for part in parts if cached[part] is None]
+    workers = min(len(misses), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            built = dict(zip(misses, ex.map(load_part, misses)))
+    else:
+        built = {part: load_part(part) for part in misses}
+    loaded = [
+        built[part] if cached[part] is None else (part[0], *cached[part], part[2])
+        for part in parts
+    ]
+
     objects = []
     next_id = 2
-    for name, stl_path, pindex in parts:
-        tris = read_binary_stl(stl_path)
-        verts, tri_idx = stl_to_indexed_mesh(tris)
+    for name, verts, tri_idx, pindex in loaded:
         objects.append(
             {
                 "id": next_id,
@@ -306,15 +756,23 @@ def main():
         )
         next_id += 1
 
-    write_3mf(OUT_ITEMS, model_xml(objects, build_mode="items"))
-    write_3mf(OUT_ASSEMBLY, model_xml(objects, build_mode="assembly"))
+    # All three outputs embed the same meshes byte-for-byte: serialize and
+    # deflate them once, and only vary the small header/assembly/build parts.
+    meshes = SharedBlob(serialize_meshes(objects, args.coord_precision))
+    assembly_id = resolve_assembly_id(objects)
+
+    write_3mf(OUT_ITEMS, wrap_model(meshes, objects, "items"))
+    write_3mf(
+        OUT_ASSEMBLY,
+        wrap_model(meshes, objects, "assembly", assembly_object_id=assembly_id),
+    )
 
     # BambuStudio-recognized project variant: adds Bambu metadata + model_settings.config
     # so the parts load as multiple extruders instead of "geometry only".
-    assembly_id = max(obj["id"] for obj in objects) + 1
-    bambu_model = model_xml(
+    bambu_model = wrap_model(
+        meshes,
         objects,
-        build_mode="assembly",
+        "assembly",
         bambu_meta=True,
         assembly_object_id=assembly_id,
     )
@@ -327,6 +785,8 @@ def main():
         },
     )
 
+    OUT_OPTIONS_STAMP.write_text(options)
+
     print(f"Wrote {OUT_ITEMS}")
     print(f"Wrote {OUT_ASSEMBLY}")
     print(f"Wrote {OUT_BAMBU_PROJECT}")
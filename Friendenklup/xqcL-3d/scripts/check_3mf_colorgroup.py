@@ -7,6 +7,7 @@ Usage:
 
 import sys
 import zipfile
+from collections import Counter
 import xml.etree.ElementTree as ET
 from pathlib import Path
 
@@ -28,85 +29,114 @@ def main() -> int:
         print(f"ERROR: file not found: {path}")
         return 2
 
+    RESOURCES = q(NS_CORE, "resources")
+    COLORGROUP = q(NS_M, "colorgroup")
+    COLOR = q(NS_M, "color")
+    OBJECT = q(NS_CORE, "object")
+    MESH = q(NS_CORE, "mesh")
+    TRIANGLES = q(NS_CORE, "triangles")
+    TRIANGLE = q(NS_CORE, "triangle")
+    BUILD = q(NS_CORE, "build")
+    ITEM = q(NS_CORE, "item")
+    TRIANGLE_PATH = (RESOURCES, OBJECT, MESH, TRIANGLES, TRIANGLE)
+
+    required = ""
+    has_resources = False
+    cg_ids = set()
+    colorgroup_count = 0
+    colors_count = 0
+    object_count = 0
+    obj_with_mesh = 0
+    item_count = 0
+    tri_total = 0
+    tri_missing = 0
+    tri_bad_p = 0
+    # pid values are checked against cg_ids once the whole file is read, so
+    # colorgroups may appear anywhere in <resources>.
+    tri_pids = Counter()
+
     with zipfile.ZipFile(path, "r") as z:
         try:
-            xml_bytes = z.read("3D/3dmodel.model")
+            model = z.open("3D/3dmodel.model")
         except KeyError:
             print("ERROR: 3MF missing 3D/3dmodel.model")
             return 1
 
-    root = ET.fromstring(xml_bytes)
-
-    # 3MF spec: requiredextensions is a space-separated list of *prefixes*.
-    required = root.attrib.get("requiredextensions", "")
-    required_tokens = required.split() if required else []
-    has_required_ext = ("m" in required_tokens)
-
-    # Also validate that xmlns:m maps to the expected material namespace.
-    # ElementTree stores namespace declarations in tags, not attrs; easiest is to
-    # just assert that we can find <m:colorgroup> using NS_M.
-
-    resources = root.find(q(NS_CORE, "resources"))
-    if resources is None:
+        # Stream the model instead of building the full DOM: every element is
+        # dropped as soon as it has been counted, so memory stays O(depth)
+        # even for meshes with millions of triangles. `paths` holds the tag
+        # path below <model> for each open element in `stack`.
+        stack = []
+        paths = [()]
+        with model:
+            for event, elem in ET.iterparse(model, events=("start", "end")):
+                if event == "start":
+                    if not stack:
+                        # 3MF spec: requiredextensions is a space-separated
+                        # list of *prefixes*.
+                        required = elem.attrib.get("requiredextensions", "")
+                    else:
+                        paths.append(paths[-1] + (elem.tag,))
+                    stack.append(elem)
+                    continue
+
+                stack.pop()
+                if not stack:
+                    break  # end of <model>
+                path_tags = paths.pop()
+
+                if path_tags == TRIANGLE_PATH:
+                    tri_total += 1
+                    pid = elem.attrib.get("pid")
+                    p1 = elem.attrib.get("p1")
+                    p2 = elem.attrib.get("p2")
+                    p3 = elem.attrib.get("p3")
+                    if pid is None or p1 is None or p2 is None or p3 is None:
+                        tri_missing += 1
+                    else:
+                        tri_pids[pid] += 1
+                        try:
+                            p1i, p2i, p3i = int(p1), int(p2), int(p3)
+                        except ValueError:
+                            tri_bad_p += 1
+                        else:
+                            if p1i < 0 or p2i < 0 or p3i < 0:
+                                tri_bad_p += 1
+                elif path_tags == (RESOURCES,):
+                    has_resources = True
+                elif path_tags == (RESOURCES, COLORGROUP):
+                    colorgroup_count += 1
+                    cg_id = elem.attrib.get("id")
+                    if cg_id is not None:
+                        cg_ids.add(cg_id)
+                elif path_tags == (RESOURCES, COLORGROUP, COLOR):
+                    colors_count += 1
+                elif path_tags == (RESOURCES, OBJECT):
+                    object_count += 1
+                elif path_tags == (RESOURCES, OBJECT, MESH):
+                    obj_with_mesh += 1
+                elif path_tags == (BUILD, ITEM):
+                    item_count += 1
+
+                elem.clear()
+                stack[-1].remove(elem)
+
+    has_required_ext = ("m" in required.split())
+
+    if not has_resources:
         print("ERROR: missing <resources>")
         return 1
 
-    colorgroups = resources.findall(q(NS_M, "colorgroup"))
-    if not colorgroups:
+    if not colorgroup_count:
         print("ERROR: no <m:colorgroup> found")
         return 1
 
-    cg_ids = {cg.attrib.get("id") for cg in colorgroups}
-    cg_ids.discard(None)
-
-    colors_count = 0
-    for cg in colorgroups:
-        colors_count += len(cg.findall(q(NS_M, "color")))
-
-    objects = resources.findall(q(NS_CORE, "object"))
-    obj_with_mesh = 0
-    tri_total = 0
-    tri_missing = 0
-    tri_bad_pid = 0
-    tri_bad_p = 0
-
-    for obj in objects:
-        mesh = obj.find(q(NS_CORE, "mesh"))
-        if mesh is None:
-            continue
-        obj_with_mesh += 1
-        triangles = mesh.find(q(NS_CORE, "triangles"))
-        if triangles is None:
-            continue
-
-        for tri in triangles.findall(q(NS_CORE, "triangle")):
-            tri_total += 1
-            pid = tri.attrib.get("pid")
-            p1 = tri.attrib.get("p1")
-            p2 = tri.attrib.get("p2")
-            p3 = tri.attrib.get("p3")
-            if pid is None or p1 is None or p2 is None or p3 is None:
-                tri_missing += 1
-                continue
-            if pid not in cg_ids:
-                tri_bad_pid += 1
-            try:
-                p1i, p2i, p3i = int(p1), int(p2), int(p3)
-            except ValueError:
-                tri_bad_p += 1
-                continue
-            if p1i < 0 or p2i < 0 or p3i < 0:
-                tri_bad_p += 1
-
-    build = root.find(q(NS_CORE, "build"))
-    item_count = 0
-    if build is not None:
-        item_count = len(build.findall(q(NS_CORE, "item")))
+    tri_bad_pid = sum(n for pid, n in tri_pids.items() if pid not in cg_ids)
 
     print(f"file: {path}")
     print(f"requiredextensions includes 'm': {has_required_ext} ({required!r})")
-    print(f"colorgroups: {len(colorgroups)} (ids={sorted(cg_ids)}) colors_total={colors_count}")
-    print(f"objects: {len(objects)} with_mesh={obj_with_mesh}")
+    print(f"colorgroups: {colorgroup_count} (ids={sorted(cg_ids)}) colors_total={colors_count}")
+    print(f"objects: {object_count} with_mesh={obj_with_mesh}")
     print(f"build items: {item_count}")
     print(f"triangles: {tri_total}")
     print(f"triangles missing pid/p1/p2/p3: {tri_missing}")